@@ -1,3 +1,9 @@
 from .urllist import URLList
 from .profileselector import *
 from .stream import Stream
+from .metrics import MetricsAggregator, Exporter, PrometheusExporter, InfluxDBExporter, InfluxDB2Exporter, \
+    FileExporter, Samples, read_samples
+from .replay import TraceSession, Replay, read_trace
+from .arrival import TimerWheel, RateCurve, SessionLength, Arrivals
+from .config import Config
+from .validation import Validator
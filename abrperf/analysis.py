@@ -0,0 +1,373 @@
+import argparse
+import glob
+import json
+import logging
+import re
+import sys
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .metrics import COLUMNS, DICTIONARIES, KINDS, TRACKS, Samples, read_samples
+
+PERCENTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+
+def load(filenames: Sequence[str]) -> Samples:
+    """
+    Loads and merges recorded samples of one run (e.g. the file sinks of all workers).
+    :param filenames: file sink (parquet, npy.zst) or InfluxDB line protocol export (anything else) files
+    :return: merged samples, the dictionary codes are remapped to a common dictionary
+    :rtype: Samples
+    """
+    parts = {column: [] for column, _ in COLUMNS}
+    dictionaries = {column: {} for column in DICTIONARIES}
+
+    for filename in filenames:
+        if filename.endswith('.parquet') or filename.endswith('.npy.zst'):
+            try:
+                samples = read_samples(filename)
+            except (OSError, ValueError) as e:
+                # e.g. the parquet file a killed worker was writing (no footer)
+                logging.warning(f"Skipping unreadable file '{filename}': {e}")
+                continue
+        else:
+            samples = load_lineprotocol(filename)
+
+        for column, _ in COLUMNS:
+            values = samples.columns[column]
+            if column in DICTIONARIES:
+                table = dictionaries[column]
+                mapping = np.array([table.setdefault(value, len(table)) for value in samples.dictionaries[column]],
+                                   dtype=np.int32)
+                values = mapping[values] if len(mapping) else values
+            parts[column].append(values)
+
+    return Samples({column: np.concatenate(parts[column]) if parts[column] else np.empty(0, dtype=dtype)
+                    for column, dtype in COLUMNS},
+                   {column: list(dictionaries[column]) for column in DICTIONARIES},
+                   [])
+
+
+_LINE = re.compile(r'^request,(?P<tags>(?:[^ \\]|\\.)*) (?P<fields>(?:[^ \\"]|\\.|"[^"]*")*) (?P<time>\d+)$')
+_SPLIT = re.compile(r'(?<!\\),')
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def load_lineprotocol(filename: str) -> Samples:
+    """
+    Loads the 'request' measurement from an InfluxDB line protocol export (e.g. influxd inspect export-lp). This is
+    the slow path, the file sink should be preferred for large runs.
+    :param filename: line protocol file
+    :return: the samples in the file
+    :rtype: Samples
+    """
+    buffer = {column: [] for column, _ in COLUMNS}
+    edges, errors = {}, {'': 0}
+
+    with open(filename, encoding='utf-8') as file:
+        for line in file:
+            match = _LINE.match(line.rstrip('\n'))
+            if match is None:
+                continue
+
+            tags = dict(tag.split('=', 1) for tag in _SPLIT.split(match['tags']))
+            fields = dict(field.split('=', 1) for field in _SPLIT.split(match['fields']))
+            edge = _unescape(tags.get('edge', 'none'))
+            error = _unescape(tags.get('exception', 'None'))
+
+            buffer['time'].append(int(match['time']))
+            buffer['session'].append(int(fields.get('session', '0i').rstrip('i')))
+            buffer['kind'].append(KINDS.index(tags['kind']) if tags.get('kind') in KINDS else 0)
+            buffer['track'].append(TRACKS.index(tags['track']) if tags.get('track') in TRACKS else 0)
+            buffer['edge'].append(edges.setdefault('' if edge == 'none' else edge, len(edges)))
+            buffer['profile'].append(int(fields.get('profile', '0i').rstrip('i')))
+            buffer['status_code'].append(int(tags.get('status_code', 0)))
+            buffer['error'].append(errors.setdefault('' if error == 'None' else error, len(errors)))
+            buffer['response_time'].append(float(fields.get('response_time', 0)))
+            buffer['response_length'].append(int(fields.get('response_length', '0i').rstrip('i')))
+            buffer['duration'].append(float(fields.get('duration', 0)))
+
+    return Samples({column: np.array(buffer[column], dtype=dtype) for column, dtype in COLUMNS},
+                   {'edge': list(edges), 'error': list(errors)},
+                   [])
+
+
+def factorize(keys: np.ndarray):
+    """
+    Dense codes for the group keys, small integer ranges (dictionary codes, time bins) are counted, not sorted.
+    :return: the unique keys and the code per key
+    """
+    if keys.dtype.kind in 'iub' and len(keys):
+        low, high = int(keys.min()), int(keys.max())
+        if high - low < 1 << 20:
+            present = np.bincount((keys - low).astype(np.int64), minlength=high - low + 1) > 0
+            lookup = np.cumsum(present) - 1
+            return np.flatnonzero(present) + low, lookup[keys - low]
+
+    return np.unique(keys, return_inverse=True)
+
+
+def stable_order(codes: np.ndarray) -> np.ndarray:
+    """
+    Stable argsort of dense non-negative codes, as radix sorts of 16 bit digits (numpy sorts 16 bit integers stably
+    in linear time, wider integers with a comparison sort).
+    """
+    order = np.argsort((codes & 0xffff).astype(np.uint16), kind='stable')
+    if len(codes) and codes.max() >> 16:
+        order = order[np.argsort((codes[order] >> 16).astype(np.uint16), kind='stable')]
+    return order
+
+
+def _group_percentiles(codes: np.ndarray, size: int, values: np.ndarray, percentiles: Sequence[float],
+                       order: np.ndarray):
+    # positions of the nearest ranks in the values sorted by group, then by value
+    counts = np.bincount(codes, minlength=size)
+    if not len(codes):
+        return counts, np.full((size, len(percentiles)), np.nan)
+    starts = np.cumsum(counts) - counts
+    # groups without values get the last value, the caller skips them
+    positions = np.minimum(starts[:, None] + np.maximum(np.ceil(np.outer(counts, percentiles)).astype(np.int64) - 1,
+                                                        0), len(codes) - 1)
+    if size > 1:
+        positions = stable_order(codes[order])[positions]
+    # only the selected values are gathered
+    return counts, values[order[positions]]
+
+
+def group_percentiles(keys: np.ndarray, values: np.ndarray, percentiles: Sequence[float] = PERCENTILES,
+                      order: np.ndarray = None):
+    """
+    Calculates percentiles of values per group, vectorized: the values are sorted once, the groups are separated by a
+    stable sort on the dense group codes, then index arithmetic on the group boundaries (nearest rank).
+    :param keys: group key per value
+    :param values: values
+    :param percentiles: percentiles in the [0, 1] range
+    :param order: argsort of values, if already known (e.g. several groupings of the same values)
+    :return: the unique keys, the number of values and a (keys x percentiles) matrix
+    """
+    if not len(keys):
+        return keys[:0], np.empty(0, dtype=np.int64), np.empty((0, len(percentiles)))
+
+    if order is None:
+        order = np.argsort(values)
+    unique, codes = factorize(keys)
+    counts, values = _group_percentiles(codes, len(unique), values, percentiles, order)
+    return unique, counts, values
+
+
+def group_sums(keys: np.ndarray, *columns: np.ndarray):
+    """
+    Sums columns per group.
+    :return: the unique keys and the sums per column
+    """
+    unique, codes = factorize(keys)
+    return unique, [np.bincount(codes, weights=column, minlength=len(unique)) for column in columns]
+
+
+def throughput(samples: Samples) -> np.ndarray:
+    """
+    Segment download throughput in bps, NaN for non segment requests.
+    """
+    columns = samples.columns
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((columns['kind'] == KINDS.index('segment')) & (columns['response_time'] > 0),
+                        columns['response_length'] * 8 / (columns['response_time'] / 1000), np.nan)
+
+
+def stalls(samples: Samples) -> np.ndarray:
+    """
+    Stall time in seconds per segment: the part of the download time exceeding the segment duration, a live player
+    without buffer stalls for this long.
+    """
+    columns = samples.columns
+    return np.maximum(columns['response_time'] / 1000 - columns['duration'], 0) * \
+        (columns['kind'] == KINDS.index('segment'))
+
+
+def switches(samples: Samples):
+    """
+    Bitrate switches of the sessions, counted per track (the audio and video segments of a session interleave).
+    :return: number of segments and number of profile switches per session
+    """
+    columns = samples.columns
+    segments = columns['kind'] == KINDS.index('segment')
+    unique, codes = factorize(columns['session'][segments])
+    time, profile = columns['time'][segments], columns['profile'][segments]
+
+    stream = codes * len(TRACKS) + columns['track'][segments]
+    order = stable_order(stream)
+    streams = stream[order]
+    same = streams[1:] == streams[:-1]
+
+    # a session is recorded by one worker, so its samples are in time order already unless the samples are not in
+    # recording order (e.g. a line protocol export)
+    time = time[order]
+    if np.any(same & (time[1:] < time[:-1])):
+        chronological = np.argsort(columns['time'][segments], kind='stable')
+        order = chronological[stable_order(stream[chronological])]
+
+    profile = profile[order]
+    switched = same & (profile[1:] != profile[:-1])
+    return np.bincount(codes, minlength=len(unique)), \
+        np.bincount(streams[1:] // len(TRACKS), weights=switched, minlength=len(unique))
+
+
+def summary(samples: Samples, percentiles: Sequence[float] = PERCENTILES) -> Dict:
+    """
+    Summary of a run: latency and throughput percentiles, stall ratio, switch rate per edge, per profile and total.
+    """
+    columns = samples.columns
+    edges = samples.dictionaries['edge']
+    failed = columns['error'] != 0
+    bps = throughput(samples)
+    stall = stalls(samples)
+    segment = columns['kind'] == KINDS.index('segment')
+    duration = columns['duration'] * segment
+
+    result = {'requests': int(len(failed)),
+              'failures': int(failed.sum()),
+              'duration': float((columns['time'].max() - columns['time'].min()) / 1e9) if len(failed) else 0.0,
+              'percentiles': list(percentiles)}
+
+    # the value orders and group codes are shared by all groupings
+    latency_order = np.argsort(columns['response_time'])
+    throughput_order = np.argsort(bps[segment])
+
+    def groups(name: str, keys: np.ndarray, label):
+        keys, codes = factorize(keys)
+        labels = [label(key) for key in keys.tolist()]
+
+        counts, latencies = _group_percentiles(codes, len(keys), columns['response_time'], percentiles,
+                                               latency_order)
+        failures, stalled, played = [np.bincount(codes, weights=column, minlength=len(keys))
+                                     for column in (failed, stall, duration)]
+        entries = {labels[code]: {'requests': int(counts[code]),
+                                  'failures': int(failures[code]),
+                                  'stall_ratio': stalled[code] / played[code] if played[code] else 0.0,
+                                  'latency': latencies[code].tolist()} for code in range(len(keys))}
+
+        codes = codes[segment]
+        counts, throughputs = _group_percentiles(codes, len(keys), bps[segment], percentiles, throughput_order)
+        for code in np.flatnonzero(counts).tolist():
+            entries[labels[code]]['throughput'] = throughputs[code].tolist()
+
+        result[name] = entries
+
+    groups('total', np.zeros(len(failed), dtype=np.int8), lambda key: 'total')
+    groups('edges', columns['edge'], lambda key: edges[key] if key < len(edges) else str(key))
+    groups('profiles', np.where(segment, columns['profile'], -1), lambda key: 'other' if key < 0 else str(key))
+
+    counts, switched = switches(samples)
+    result['switch_rate'] = float(switched.sum() / counts.sum()) if counts.sum() else 0.0
+    result['sessions'] = int(len(counts))
+
+    return result
+
+
+def timeseries(samples: Samples, interval: float = 10, percentiles: Sequence[float] = PERCENTILES) -> Dict:
+    """
+    Per interval request rate, failure rate, bandwidth, latency percentiles and stall ratio over the run.
+    """
+    columns = samples.columns
+    if not len(columns['time']):
+        return {'time': [], 'interval': interval}
+
+    bins = ((columns['time'] - columns['time'].min()) // int(interval * 1e9)).astype(np.int64)
+    segment = columns['kind'] == KINDS.index('segment')
+    unique, (requests, failures, length, stalled, played) = \
+        group_sums(bins, np.ones(len(bins)), columns['error'] != 0, columns['response_length'], stalls(samples),
+                   columns['duration'] * segment)
+    _, _, latencies = group_percentiles(bins, columns['response_time'], percentiles)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stall_ratio = np.where(played > 0, stalled / played, 0.0)
+
+    return {'time': (unique * interval).tolist(),
+            'interval': interval,
+            'requests': (requests / interval).tolist(),
+            'failures': (failures / interval).tolist(),
+            'bandwidth': (length * 8 / interval).tolist(),
+            'latency': latencies.tolist(),
+            'stall_ratio': stall_ratio.tolist()}
+
+
+def compare(a: Dict, b: Dict) -> Dict:
+    """
+    Compares the summaries of two runs: the relative change (b / a - 1) of every numeric value present in both.
+    """
+
+    def diff(x, y):
+        if isinstance(x, dict) and isinstance(y, dict):
+            return {key: diff(x[key], y[key]) for key in x if key in y}
+        if isinstance(x, list) and isinstance(y, list) and len(x) == len(y):
+            return [diff(i, j) for i, j in zip(x, y)]
+        if isinstance(x, (int, float)) and isinstance(y, (int, float)) and not isinstance(x, bool):
+            return y / x - 1 if x else None
+        return None
+
+    return {key: diff(a[key], b[key]) for key in a if key in b and key != 'percentiles'}
+
+
+def _format(result: Dict, out) -> None:
+    percentiles = ' '.join(f"{p * 100:>9g}%" for p in result['percentiles'])
+    print(f"requests: {result['requests']}, failures: {result['failures']}, sessions: {result['sessions']}, "
+          f"duration: {result['duration']:.0f}s, switch rate: {result['switch_rate']:.4f}/segment", file=out)
+
+    for group in ['total', 'edges', 'profiles']:
+        print(f"\n{group:<40} {'requests':>10} {'failures':>10} {'stall':>8} | latency (ms) {percentiles}", file=out)
+        for key, entry in result[group].items():
+            latency = ' '.join(f"{value:>10.1f}" for value in entry['latency'])
+            print(f"{key:<40} {entry['requests']:>10} {entry['failures']:>10} {entry['stall_ratio']:>8.4f} | "
+                  f"{'':>12} {latency}", file=out)
+            if 'throughput' in entry:
+                mbps = ' '.join(f"{value / 1e6:>10.2f}" for value in entry['throughput'])
+                print(f"{'':<40} {'':>10} {'':>10} {'':>8} | {'Mbps':>12} {mbps}", file=out)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline analysis of recorded abrperf runs")
+    parser.add_argument('files', nargs='+', help="file sink or line protocol files (glob patterns) of the run")
+    parser.add_argument('--compare', nargs='+', metavar='FILE', help="files of a second run to compare with")
+    parser.add_argument('--percentiles', default=','.join(map(str, PERCENTILES)),
+                        help="comma separated percentiles (default: %(default)s)")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="add a time series with this interval in seconds")
+    parser.add_argument('--json', action='store_true', help="print the results as json")
+    args = parser.parse_args(argv)
+
+    percentiles = list(map(float, args.percentiles.split(sep=',')))
+
+    def analyze(patterns):
+        filenames = sorted(filename for pattern in patterns for filename in (glob.glob(pattern) or [pattern]))
+        samples = load(filenames)
+        result = summary(samples, percentiles)
+        if args.interval:
+            result['timeseries'] = timeseries(samples, args.interval, percentiles)
+        return result
+
+    result = analyze(args.files)
+    if args.compare:
+        result = {'a': result, 'b': analyze(args.compare)}
+        result['change'] = compare(result['a'], result['b'])
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    elif args.compare:
+        for run in ['a', 'b']:
+            print(f"*** run {run} ***")
+            _format(result[run], sys.stdout)
+            print()
+        print("*** relative change (b / a - 1) ***")
+        json.dump(result['change'], sys.stdout, indent=2)
+        print()
+    else:
+        _format(result, sys.stdout)
+        if args.interval:
+            print(f"\ntime series: {json.dumps(result['timeseries'])}")
+
+    return 0
@@ -0,0 +1,216 @@
+import bisect
+import logging
+import random
+import time
+from typing import Callable, List, Tuple
+
+import gevent
+import numpy as np
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel: scheduling and cancelling a timer is O(1), a tick only visits the timers of one slot, so tens
+    of thousands of pending timers (session arrivals) cost one greenlet instead of one timer each.
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 4096):
+        self._tick = tick
+        self._slots = slots
+        self._wheel = [[] for _ in range(slots)]
+        self._current = int(time.time() / tick)
+        self._pending = 0
+        self._greenlet = None
+
+    def schedule(self, when: float, callback: Callable, *args) -> list:
+        """
+        Schedules callback(*args) at the epoch when (with tick resolution, timers in the past fire on the next tick).
+        :return: the timer, can be cancelled
+        """
+        tick = max(int(when / self._tick), self._current + 1)
+        timer = [tick, when, callback, args, True]
+        self._wheel[tick % self._slots].append(timer)
+        self._pending += 1
+        return timer
+
+    def cancel(self, timer: list):
+        # removed lazily, when its slot is visited
+        if timer[4]:
+            timer[4] = False
+            self._pending -= 1
+
+    def advance(self, now: float) -> int:
+        """
+        Fires the timers expired until now, in the order of their scheduled time.
+        :return: number of timers fired
+        """
+        target = int(now / self._tick)
+        if target <= self._current:
+            return 0
+
+        if target - self._current >= self._slots:
+            indices = range(self._slots)
+        else:
+            indices = [tick % self._slots for tick in range(self._current + 1, target + 1)]
+        self._current = target
+
+        expired = []
+        for index in indices:
+            slot = self._wheel[index]
+            if slot:
+                self._wheel[index] = [timer for timer in slot if timer[0] > target and timer[4]]
+                expired.extend(timer for timer in slot if timer[0] <= target and timer[4])
+
+        expired.sort(key=lambda timer: timer[1])
+        for timer in expired:
+            timer[4] = False
+            self._pending -= 1
+            try:
+                timer[2](*timer[3])
+            except Exception:
+                logging.exception(f"Exception in timer callback {timer[2]}")
+
+        return len(expired)
+
+    def start(self):
+        def run():
+            while True:
+                self.advance(time.time())
+                gevent.sleep(self._tick)
+
+        self._greenlet = gevent.spawn(run)
+
+    def stop(self):
+        # no timer fires after stop() returns
+        if self._greenlet:
+            self._greenlet.kill(block=True)
+            self._greenlet = None
+
+    def __len__(self):
+        return self._pending
+
+
+class RateCurve:
+    """
+    Piecewise linear arrival rate (sessions/s) over the test time (s), constant after the last point.
+    """
+
+    def __init__(self, points: List[Tuple[float, float]]):
+        if not points:
+            raise ValueError("Empty arrival rate curve!")
+        if any(rate < 0 for _, rate in points):
+            raise ValueError(f"Negative arrival rate in {points}!")
+
+        points = sorted(points)
+        self._times = [t for t, _ in points]
+        self._rates = [rate for _, rate in points]
+
+    @classmethod
+    def parse(cls, value: str) -> 'RateCurve':
+        """
+        Parses a constant rate ('10') or a curve ('0:10,1800:50,3600:10', time:rate pairs).
+        """
+        try:
+            if ':' not in value:
+                return cls([(0, float(value))])
+            return cls([tuple(map(float, point.split(':'))) for point in value.split(sep=',')])
+        except ValueError:
+            raise ValueError(f"Invalid arrival rate curve '{value}'!")
+
+    def __call__(self, t: float) -> float:
+        i = bisect.bisect_right(self._times, t)
+        if i == 0:
+            return self._rates[0]
+        if i == len(self._times):
+            return self._rates[-1]
+        t0, t1, r0, r1 = self._times[i - 1], self._times[i], self._rates[i - 1], self._rates[i]
+        return r0 + (r1 - r0) * (t - t0) / (t1 - t0)
+
+    def scaled(self, factor: float) -> 'RateCurve':
+        return RateCurve([(t, rate * factor) for t, rate in zip(self._times, self._rates)])
+
+
+class SessionLength:
+    """
+    Random session (watch) durations in seconds: 'lognormal:mu,sigma', 'pareto:alpha,minimum', 'exponential:mean',
+    'constant:duration' or 'endless'.
+    """
+
+    def __init__(self, value: str):
+        self._value = value
+        name, _, params = value.partition(':')
+        try:
+            params = [float(param) for param in params.split(sep=',') if param]
+        except ValueError:
+            raise ValueError(f"Invalid session length distribution '{value}'!")
+
+        if name == 'lognormal' and len(params) == 2:
+            self._draw = lambda: random.lognormvariate(*params)
+        elif name == 'pareto' and len(params) == 2:
+            self._draw = lambda: params[1] * random.paretovariate(params[0])
+        elif name == 'exponential' and len(params) == 1:
+            self._draw = lambda: random.expovariate(1 / params[0])
+        elif name == 'constant' and len(params) == 1:
+            self._draw = lambda: params[0]
+        elif name == 'endless' and not params:
+            self._draw = lambda: None
+        else:
+            raise ValueError(f"Invalid session length distribution '{value}'!")
+
+    def __call__(self):
+        return self._draw()
+
+    def __str__(self):
+        return self._value
+
+
+class Arrivals:
+    """
+    Open-loop arrival process: users arrive as a (time varying) Poisson process and leave after a random session
+    length, the number of concurrent users is emergent. Arrivals are drawn for a window ahead and scheduled on a timer
+    wheel, the session length is set as the user's deadline (like the duration of a replayed session).
+    """
+
+    def __init__(self, environment, user_class, rate: RateCurve, length: SessionLength, window: float = 1.0):
+        self._environment = environment
+        self._user_class = user_class
+        self._rate = rate
+        self._length = length
+        self._window = window
+        self._wheel = TimerWheel()
+        self._generator = np.random.default_rng()
+        self._started = None
+        self._arrived = 0
+
+    def start(self):
+        self._started = time.time()
+        self._wheel.start()
+        self._wheel.schedule(self._started, self._draw, self._started)
+
+    def stop(self):
+        self._wheel.stop()
+        if self._started is not None:
+            logging.info(f"Arrivals stopped, {self._arrived} session(s) arrived in {time.time() - self._started:.0f}s")
+
+    def _draw(self, begin: float):
+        # Poisson number of arrivals in the window (rate taken at the window's middle), uniformly distributed
+        end = begin + self._window
+        count = self._generator.poisson(self._rate((begin + end) / 2 - self._started) * self._window)
+        for when in self._generator.uniform(begin, end, count).tolist():
+            self._wheel.schedule(when, self._arrive)
+
+        # draw the next window before this one is over
+        self._wheel.schedule(end - self._window / 2, self._draw, end)
+
+    def _arrive(self):
+        user = self._user_class(self._environment)
+        # the stream ends the session gracefully at the deadline
+        length = self._length()
+        if length is not None:
+            user.deadline = time.time() + length
+        user.start(self._environment.runner.user_greenlets)
+        self._arrived += 1
+
+    @property
+    def arrived(self) -> int:
+        return self._arrived
@@ -0,0 +1,80 @@
+import time
+import zlib
+from typing import Dict, Optional
+
+from .profileselector import PROFILESELECTIONS, ProfileSelector, create_profileselector
+from .urllist import URLList
+
+
+class Config:
+    """
+    Test configuration, loaded once by the master and distributed to the workers with custom messages. A new version
+    replaces the previous one on the workers at runtime. The versions count per instance (master start), a restarted
+    master starts again with version 0.
+    """
+
+    def __init__(self, urllist: Optional[URLList], profileselection: str, version: int = 0,
+                 instance: Optional[float] = None):
+        """
+        :param instance: id of the loading master instance, its start time by default
+        :raises ValueError: for an unknown profileselection
+        """
+        if profileselection not in PROFILESELECTIONS:
+            raise ValueError(f"unknown profileselection '{profileselection}', expected one of "
+                             f"{', '.join(PROFILESELECTIONS)}")
+        self._urllist = urllist
+        self._profileselection = profileselection
+        self._version = version
+        self._instance = time.time() if instance is None else instance
+
+    def dumps(self) -> Dict:
+        """
+        Compact form for the custom message: the urllist is sent as zlib compressed csv.
+        """
+        return {'instance': self._instance,
+                'version': self._version,
+                'profileselection': self._profileselection,
+                'filename': self._urllist.filename if self._urllist else None,
+                'urllist': zlib.compress(self._urllist.dumps().encode(), 9) if self._urllist else None}
+
+    @classmethod
+    def loads(cls, data: Dict) -> 'Config':
+        urllist = URLList(data['filename'], zlib.decompress(data['urllist']).decode()) if data['urllist'] else None
+        return cls(urllist, data['profileselection'], data['version'], data['instance'])
+
+    def update(self, urllist: Optional[URLList] = None, profileselection: Optional[str] = None) -> 'Config':
+        """
+        Returns the next version of the config with the given parts replaced.
+        """
+        return Config(urllist or self._urllist, profileselection or self._profileselection, self._version + 1,
+                      self._instance)
+
+    def supersedes(self, other: Optional['Config']) -> bool:
+        """
+        Whether this config replaces the other one: a newer version or any version of another (e.g. restarted)
+        instance.
+        """
+        return other is None or self._instance != other._instance or self._version > other._version
+
+    def profileselector(self) -> ProfileSelector:
+        return create_profileselector(self._profileselection)
+
+    @property
+    def urllist(self) -> Optional[URLList]:
+        return self._urllist
+
+    @property
+    def profileselection(self) -> str:
+        return self._profileselection
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def instance(self) -> float:
+        return self._instance
+
+    def __str__(self):
+        return f"config v{self._version}: {self.profileselector()}, " + \
+            (f"{self._urllist.filename} with {len(self._urllist)} url(s)" if self._urllist else "no urllist")
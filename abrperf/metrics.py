@@ -0,0 +1,501 @@
+import bisect
+import gzip
+import logging
+import os
+import platform
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# request kinds, the index is stored in the samples
+KINDS = ('other', 'manifest', 'playlist', 'segment')
+
+# media tracks, the index is stored in the samples
+TRACKS = ('', 'video', 'audio')
+
+# response time histogram buckets in milliseconds (upper bounds, +Inf is implicit)
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# sample columns and their types, order matters for the file sink
+COLUMNS = (('time', np.int64),
+           ('session', np.int64),
+           ('kind', np.int8),
+           ('track', np.int8),
+           ('edge', np.int32),
+           ('profile', np.int64),
+           ('status_code', np.int16),
+           ('error', np.int32),
+           ('response_time', np.float64),
+           ('response_length', np.int64),
+           ('duration', np.float32))
+
+# columns stored as codes into a string dictionary
+DICTIONARIES = ('edge', 'error')
+
+
+class Samples:
+    """
+    A columnar batch of recorded requests, drained from the MetricsAggregator. The request names are not stored by
+    the file sink, they are empty for loaded samples.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], dictionaries: Dict[str, List[str]], names: List[str]):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.names = names
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+
+class MetricsAggregator:
+    """
+    In-process aggregates of the request events. Every request is recorded exactly once, exporters read the
+    pre-aggregated counters and histograms or the drained sample batches, so adding an exporter costs no extra
+    per-request work.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self._buckets = tuple(buckets)
+        self._started = time.time()
+
+        # (kind, edge, status_code) -> [requests, failures, bytes]
+        self._counters = {}
+        # (kind, edge) -> [bucket counts..., +Inf count, sum]
+        self._histograms = {}
+
+        # string dictionaries, append only, so codes stay valid during the whole run
+        self._edges = {}
+        self._errors = {'': 0}
+
+        self._clear()
+
+    def _clear(self):
+        self._buffer = {column: [] for column, _ in COLUMNS}
+        self._names = []
+
+    def _intern(self, table: Dict[str, int], value: str) -> int:
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def on_request(self, request_type: str, name: str, response_time: float, response_length: int, response,
+                   context: Dict, exception: Exception, **kwargs):
+        """
+        Request event listener, records a single request.
+        """
+        kind = KINDS.index(context.get('kind', 'other'))
+        track = TRACKS.index(context.get('track', ''))
+        status_code = getattr(response, 'status_code', 0) or 0
+        edge = name.split('/', 3)[2] if '://' in name else ''
+        error = '' if exception is None else str(exception)
+        response_time = response_time or 0
+        response_length = response_length or 0
+
+        # pre-aggregated counters
+        counter = self._counters.get((kind, edge, status_code))
+        if counter is None:
+            counter = self._counters[(kind, edge, status_code)] = [0, 0, 0]
+        counter[0] += 1
+        counter[1] += exception is not None
+        counter[2] += response_length
+
+        histogram = self._histograms.get((kind, edge))
+        if histogram is None:
+            histogram = self._histograms[(kind, edge)] = [0] * (len(self._buckets) + 2)
+        histogram[bisect.bisect_left(self._buckets, response_time)] += 1
+        histogram[-1] += response_time
+
+        # raw samples for the push exporters
+        buffer = self._buffer
+        buffer['time'].append(time.time_ns())
+        buffer['session'].append(context.get('session', 0))
+        buffer['kind'].append(kind)
+        buffer['track'].append(track)
+        buffer['edge'].append(self._intern(self._edges, edge))
+        buffer['profile'].append(context.get('profile') or 0)
+        buffer['status_code'].append(status_code)
+        buffer['error'].append(self._intern(self._errors, error))
+        buffer['response_time'].append(response_time)
+        buffer['response_length'].append(response_length)
+        buffer['duration'].append(context.get('duration') or 0)
+        self._names.append(name)
+
+    def drain(self) -> Samples:
+        """
+        Returns the samples recorded since the last call as a columnar batch.
+        """
+        buffer, names = self._buffer, self._names
+        self._clear()
+
+        return Samples({column: np.array(buffer[column], dtype=dtype) for column, dtype in COLUMNS},
+                       {'edge': list(self._edges), 'error': list(self._errors)},
+                       names)
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    @property
+    def counters(self) -> Dict:
+        return self._counters
+
+    @property
+    def histograms(self) -> Dict:
+        return self._histograms
+
+    @property
+    def started(self) -> float:
+        return self._started
+
+
+class Exporter(ABC):
+    """
+    Metrics sink, fed from the MetricsAggregator.
+    """
+
+    def start(self, aggregator: MetricsAggregator):
+        pass
+
+    @abstractmethod
+    def export(self, samples: Samples):
+        pass
+
+    def close(self):
+        pass
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class PrometheusExporter(Exporter):
+    """
+    Serves the pre-aggregated counters and histograms on a /metrics endpoint. Workers sharing the host network try the
+    next port, if the configured one is taken.
+    """
+
+    def __init__(self, port: int = 9646, ports: int = 100):
+        self._port = port
+        self._ports = ports
+        self._server = None
+        self._aggregator = None
+
+    def start(self, aggregator: MetricsAggregator):
+        from gevent.pywsgi import WSGIServer
+
+        self._aggregator = aggregator
+
+        for port in range(self._port, self._port + self._ports):
+            try:
+                self._server = WSGIServer(('', port), self._application, log=None)
+                self._server.start()
+                break
+            except OSError:
+                self._server = None
+        else:
+            raise OSError(f"No free port for the prometheus endpoint in {self._port}-{self._port + self._ports - 1}")
+
+        logging.info(f"Serving prometheus metrics on port {self._server.server_port}")
+
+    def _application(self, environ, start_response):
+        if environ.get('PATH_INFO') != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'not found\n']
+
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+        return [self.render().encode()]
+
+    def render(self) -> str:
+        """
+        Renders the aggregates in the prometheus text exposition format.
+        """
+        lines = []
+        node = platform.node()
+
+        lines.append('# TYPE abrperf_requests_total counter')
+        lines.append('# TYPE abrperf_request_failures_total counter')
+        lines.append('# TYPE abrperf_response_bytes_total counter')
+        for (kind, edge, status_code), (requests, failures, length) in list(self._aggregator.counters.items()):
+            labels = f'server="{node}",kind="{KINDS[kind]}",edge="{edge}",status_code="{status_code}"'
+            lines.append(f'abrperf_requests_total{{{labels}}} {requests}')
+            lines.append(f'abrperf_request_failures_total{{{labels}}} {failures}')
+            lines.append(f'abrperf_response_bytes_total{{{labels}}} {length}')
+
+        lines.append('# TYPE abrperf_response_time_milliseconds histogram')
+        for (kind, edge), histogram in list(self._aggregator.histograms.items()):
+            labels = f'server="{node}",kind="{KINDS[kind]}",edge="{edge}"'
+            cumulative = 0
+            for bucket, count in zip(self._aggregator.buckets + ('+Inf',), histogram):
+                cumulative += count
+                lines.append(f'abrperf_response_time_milliseconds_bucket{{{labels},le="{bucket}"}} {cumulative}')
+            lines.append(f'abrperf_response_time_milliseconds_sum{{{labels}}} {histogram[-1]}')
+            lines.append(f'abrperf_response_time_milliseconds_count{{{labels}}} {cumulative}')
+
+        lines.append('# TYPE abrperf_start_time_seconds gauge')
+        lines.append(f'abrperf_start_time_seconds{{server="{node}"}} {self._aggregator.started}')
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, samples: Samples):
+        # pull based, scrapes read the aggregates directly
+        pass
+
+    def close(self):
+        if self._server:
+            self._server.stop()
+
+
+class InfluxDBExporter(Exporter):
+    """
+    Writes the samples to InfluxDB 1.x (or to the 1.x compatibility API of 2.x).
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str, database: str, batch_size: int = 5000):
+        from influxdb import InfluxDBClient
+
+        self._batch_size = batch_size
+        self._client = InfluxDBClient(host, port, username, password, database, proxies={})
+        self._client.ping()
+
+    def export(self, samples: Samples):
+        if not len(samples):
+            return
+
+        node = platform.node()
+        columns = samples.columns
+        edges, errors = samples.dictionaries['edge'], samples.dictionaries['error']
+
+        points = [{'measurement': 'request',
+                   'tags': {
+                       'name': samples.names[i],
+                       'server': node,
+                       'edge': edges[columns['edge'][i]],
+                       'kind': KINDS[columns['kind'][i]],
+                       'track': TRACKS[columns['track'][i]] or 'none',
+                       'status_code': int(columns['status_code'][i]),
+                       'exception': errors[columns['error'][i]] or 'None'
+                   },
+                   'time': int(columns['time'][i]),
+                   'fields': {
+                       'response_time': float(columns['response_time'][i]),
+                       'response_length': int(columns['response_length'][i]),
+                       'session': int(columns['session'][i]),
+                       'profile': int(columns['profile'][i]),
+                       'duration': float(columns['duration'][i])
+                   }
+                   } for i in range(len(samples))]
+        self._client.write_points(points, batch_size=self._batch_size)
+
+    def close(self):
+        self._client.close()
+
+
+class InfluxDB2Exporter(Exporter):
+    """
+    Writes the samples to the InfluxDB 2.x write API in line protocol, gzip compressed batches.
+    """
+
+    def __init__(self, url: str, org: str, bucket: str, token: str, batch_size: int = 5000):
+        import requests
+
+        self._url = f"{url.rstrip('/')}/api/v2/write"
+        self._params = {'org': org, 'bucket': bucket, 'precision': 'ns'}
+        self._batch_size = batch_size
+        self._session = requests.Session()
+        self._session.trust_env = False
+        self._session.headers.update({'Authorization': f"Token {token}",
+                                      'Content-Type': 'text/plain; charset=utf-8',
+                                      'Content-Encoding': 'gzip'})
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        # the line protocol has no escape for line breaks (e.g. in exception messages), they become spaces
+        value = value.replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
+        return value.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+    def lines(self, samples: Samples) -> List[str]:
+        """
+        Converts the samples to line protocol.
+        """
+        node = self._escape(platform.node())
+        columns = samples.columns
+        edges = [self._escape(edge) or 'none' for edge in samples.dictionaries['edge']]
+        errors = [self._escape(error) or 'None' for error in samples.dictionaries['error']]
+
+        return [f"request,server={node},name={self._escape(name)},edge={edges[edge]},kind={KINDS[kind]},"
+                f"track={TRACKS[track] or 'none'},status_code={status_code},exception={errors[error]} "
+                f"response_time={response_time},response_length={response_length}i,session={session}i,"
+                f"profile={profile}i,duration={duration} {timestamp}"
+                for name, edge, kind, track, status_code, error, response_time, response_length, session, profile,
+                duration, timestamp in
+                zip(samples.names,
+                    columns['edge'].tolist(),
+                    columns['kind'].tolist(),
+                    columns['track'].tolist(),
+                    columns['status_code'].tolist(),
+                    columns['error'].tolist(),
+                    columns['response_time'].tolist(),
+                    columns['response_length'].tolist(),
+                    columns['session'].tolist(),
+                    columns['profile'].tolist(),
+                    columns['duration'].tolist(),
+                    columns['time'].tolist())]
+
+    def export(self, samples: Samples):
+        lines = self.lines(samples)
+        for i in range(0, len(lines), self._batch_size):
+            body = gzip.compress('\n'.join(lines[i:i + self._batch_size]).encode(), compresslevel=5)
+            response = self._session.post(self._url, params=self._params, data=body, timeout=10)
+            if response.status_code >= 300:
+                logging.error(f"InfluxDB write failed: HTTP {response.status_code} {response.text}")
+
+    def close(self):
+        self._session.close()
+
+
+class FileExporter(Exporter):
+    """
+    Writes the samples to local files for offline analysis: zstd compressed Parquet if pyarrow is available,
+    otherwise a zstd compressed stream of numpy arrays (see read_samples()). A new file is started every rollover
+    seconds, a parquet file is only readable once closed (footer), so a killed worker loses only the open file.
+    """
+
+    def __init__(self, directory: str = '.', fmt: Optional[str] = None, rollover: float = 300):
+        if fmt is None:
+            fmt = 'parquet' if pyarrow is not None else 'npy'
+
+        if fmt == 'parquet' and pyarrow is None:
+            raise ImportError("pyarrow is needed for the parquet file sink")
+        if fmt == 'npy' and zstandard is None:
+            raise ImportError("zstandard is needed for the npy file sink")
+        if fmt not in ['parquet', 'npy']:
+            raise ValueError(f"Unknown file sink format '{fmt}'!")
+
+        # fail at startup, not with every flush of the lazily opened files
+        os.makedirs(directory, exist_ok=True)
+        if not os.access(directory, os.W_OK):
+            raise PermissionError(f"File sink directory '{directory}' is not writable!")
+
+        self._directory = directory
+        self._format = fmt
+        self._rollover = rollover
+        self._prefix = f"abrperf-{platform.node()}-{os.getpid()}-{int(time.time())}"
+        self._files = 0
+        self._filename = None
+        self._opened = None
+        self._writer = None
+        self._file = None
+
+        logging.info(f"Writing samples to {os.path.join(directory, self._prefix)}-*."
+                     f"{'parquet' if fmt == 'parquet' else 'npy.zst'}, new file every {rollover}s")
+
+    def _open(self, schema=None):
+        self._filename = os.path.join(self._directory, f"{self._prefix}-{self._files:05d}."
+                                                       f"{'parquet' if self._format == 'parquet' else 'npy.zst'}")
+        self._files += 1
+        self._opened = time.time()
+
+        if self._format == 'parquet':
+            self._writer = pyarrow.parquet.ParquetWriter(self._filename, schema, compression='zstd')
+        else:
+            self._file = open(self._filename, 'wb')
+            self._writer = zstandard.ZstdCompressor(level=3).stream_writer(self._file)
+        logging.debug(f"Writing samples to {self._filename}")
+
+    def export(self, samples: Samples):
+        if not len(samples):
+            return
+
+        if self._writer is not None and time.time() - self._opened >= self._rollover:
+            self.close()
+
+        if self._format == 'parquet':
+            table = pyarrow.table(
+                {column: pyarrow.DictionaryArray.from_arrays(samples.columns[column],
+                                                             pyarrow.array(samples.dictionaries[column]))
+                 if column in DICTIONARIES else samples.columns[column] for column, _ in COLUMNS})
+            if self._writer is None:
+                self._open(table.schema)
+            self._writer.write_table(table)
+        else:
+            if self._writer is None:
+                self._open()
+            # columns in COLUMNS order, then the dictionaries (append only, the last ones are valid for all)
+            for column, _ in COLUMNS:
+                np.save(self._writer, samples.columns[column], allow_pickle=False)
+            for column in DICTIONARIES:
+                np.save(self._writer, np.array(samples.dictionaries[column], dtype=str), allow_pickle=False)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        self._file = None
+
+    @property
+    def filename(self):
+        """
+        The file written currently (or last), None before the first export.
+        """
+        return self._filename
+
+
+def read_samples(filename: str) -> Samples:
+    """
+    Reads back a file written by the FileExporter.
+    :param filename: parquet or npy.zst file
+    :return: all samples of the file (without request names)
+    :rtype: Samples
+    """
+    if filename.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError("pyarrow is needed to read parquet files")
+
+        table = pyarrow.parquet.read_table(filename).unify_dictionaries()
+        columns, dictionaries = {}, {}
+        for column, dtype in COLUMNS:
+            chunks = table.column(column).chunks
+            if column in DICTIONARIES:
+                dictionaries[column] = chunks[0].dictionary.to_pylist() if chunks else []
+                chunks = [chunk.indices for chunk in chunks]
+            columns[column] = np.concatenate([chunk.to_numpy() for chunk in chunks]).astype(dtype) if chunks else \
+                np.empty(0, dtype=dtype)
+        return Samples(columns, dictionaries, [])
+
+    if zstandard is None:
+        raise ImportError("zstandard is needed to read npy.zst files")
+
+    parts = {column: [] for column, _ in COLUMNS}
+    dictionaries = {column: [] for column in DICTIONARIES}
+    with open(filename, 'rb') as file:
+        reader = zstandard.ZstdDecompressor().stream_reader(file)
+        while True:
+            try:
+                array = np.lib.format.read_array(reader, allow_pickle=False)
+            except ValueError:
+                # end of stream
+                break
+            parts[COLUMNS[0][0]].append(array)
+            for column, _ in COLUMNS[1:]:
+                parts[column].append(np.lib.format.read_array(reader, allow_pickle=False))
+            for column in DICTIONARIES:
+                dictionaries[column] = np.lib.format.read_array(reader, allow_pickle=False).tolist()
+
+    return Samples({column: np.concatenate(parts[column]) if parts[column] else np.empty(0, dtype=dtype)
+                    for column, dtype in COLUMNS}, dictionaries, [])
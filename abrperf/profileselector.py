@@ -1,4 +1,6 @@
+import bisect
 import random
+import time
 from abc import ABC, abstractmethod
 
 
@@ -11,6 +13,11 @@ class ProfileSelector(ABC):
         return self.__class__.__name__
 
 
+class RandomProfileSelector(ProfileSelector):
+    def select(self, items, key: callable, throughput: float, condition: callable = lambda x: True):
+        return super().select(items, key, throughput, condition)
+
+
 class MinProfileSelector(ProfileSelector):
     def select(self, items, key: callable, throughput: float, condition: callable = lambda x: True):
         return min(filter(condition, items), key=key)
@@ -25,3 +32,38 @@ class ABRProfileSelector(ProfileSelector):
     def select(self, items, key: callable, throughput: float, condition: callable = lambda x: True):
         return max([item for item in filter(condition, items) if key(item) < throughput], key=key,
                    default=list(filter(condition, items))[0])
+
+
+PROFILESELECTIONS = ('min', 'max', 'abr', 'rnd')
+
+
+def create_profileselector(method: str) -> ProfileSelector:
+    """
+    Returns the profile selector for the method: 'min', 'max', 'abr' or 'rnd'.
+    :raises ValueError: for any other method
+    """
+    if method == 'min':
+        return MinProfileSelector()
+    elif method == 'max':
+        return MaxProfileSelector()
+    elif method == 'abr':
+        return ABRProfileSelector()
+    elif method == 'rnd':
+        return RandomProfileSelector()
+    raise ValueError(f"unknown profileselection '{method}', expected one of {', '.join(PROFILESELECTIONS)}")
+
+
+class TraceProfileSelector(ProfileSelector):
+    """
+    Follows the profile switches of a replayed session: selects the profile with the bandwidth closest to the one
+    recorded in the trace at the current session offset.
+    """
+
+    def __init__(self, profiles: list, started: float = None):
+        self._offsets = [offset for offset, _ in profiles]
+        self._bandwidths = [bandwidth for _, bandwidth in profiles]
+        self._started = time.time() if started is None else started
+
+    def select(self, items, key: callable, throughput: float, condition: callable = lambda x: True):
+        index = max(bisect.bisect_right(self._offsets, time.time() - self._started) - 1, 0)
+        return min(filter(condition, items), key=lambda item: abs(key(item) - self._bandwidths[index]))
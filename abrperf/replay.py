@@ -0,0 +1,145 @@
+import csv
+import gzip
+import io
+import logging
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import gevent
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TraceSession:
+    """
+    A player session of the trace: start time (s), master manifest URL, session duration (s, None for endless) and
+    profile switches as (offset (s), bandwidth (bps)) tuples.
+    """
+    __slots__ = ('start', 'url', 'duration', 'profiles')
+
+    def __init__(self, start: float, url: str, duration: Optional[float] = None,
+                 profiles: List[Tuple[float, int]] = ()):
+        self.start = start
+        self.url = url
+        self.duration = duration
+        self.profiles = list(profiles)
+
+    def __repr__(self):
+        return f"TraceSession({self.start}, {self.url!r}, {self.duration}, {self.profiles})"
+
+
+def _open(filename: str) -> io.TextIOBase:
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', newline='')
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"zstandard is needed to read '{filename}'")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True),
+                                newline='')
+    return open(filename, newline='')
+
+
+def read_trace(filename: str, index: int = 0, count: int = 1) -> Iterator[TraceSession]:
+    """
+    Reads the sessions of a trace file lazily, memory use does not depend on the trace size. The trace is a csv file
+    (optionally .gz or .zst compressed) ordered by start time, with the columns start time (s), master manifest URL,
+    session duration (s, empty for endless) and profile switches (optional, 'offset:bandwidth;offset:bandwidth...').
+    :param filename: trace file
+    :param index: index of this worker, only every count-th session from the index-th one is returned
+    :param count: number of workers sharing the trace
+    :return: generator of the sessions of this worker
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid trace partition {index}/{count}!")
+
+    with _open(filename) as file:
+        n = -1
+        previous = None
+        for line in file:
+            # skip comment and empty lines
+            if not line.strip() or line.startswith('#'):
+                continue
+
+            # partition before parsing, other workers' sessions cost only the decompression
+            n += 1
+            if n % count != index:
+                continue
+
+            row = next(csv.reader([line], delimiter=',', quotechar='"', skipinitialspace=True))
+            if len(row) < 2:
+                raise SyntaxError(f"trace file '{filename}' must have at least two columns: '{', '.join(row)}'!")
+
+            try:
+                start = float(row[0])
+                duration = float(row[2]) if len(row) > 2 and row[2].strip() else None
+                profiles = [(float(offset), int(bandwidth))
+                            for offset, bandwidth in (switch.split(':') for switch in row[3].split(';') if switch)] \
+                    if len(row) > 3 else []
+            except ValueError:
+                raise ValueError(f"Invalid session in trace file '{filename}': '{line.strip()}'!")
+
+            if previous is not None and start < previous:
+                raise ValueError(f"Trace file '{filename}' is not ordered by start time: '{line.strip()}'!")
+            previous = start
+
+            yield TraceSession(start, row[1], duration, profiles)
+
+
+class Replay:
+    """
+    Spawns a user for every session of the trace at the session's start time, relative to the start of the replay.
+    The number of concurrent users is determined by the trace.
+    """
+
+    def __init__(self, environment, user_class, sessions: Iterator[TraceSession], speed: float = 1.0,
+                 origin: float = 0.0):
+        """
+        :param sessions: sessions of this worker's partition
+        :param speed: arrival speedup
+        :param origin: trace time at the start of the replay, the same for all workers (not the start of the
+        partition's first session)
+        """
+        self._environment = environment
+        self._user_class = user_class
+        self._sessions = sessions
+        self._speed = speed
+        self._origin = origin
+        self._greenlet = None
+        self._spawned = 0
+        self._late = 0
+
+    def start(self):
+        self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        # no session is spawned after stop() returns
+        if self._greenlet:
+            self._greenlet.kill(block=True)
+            self._greenlet = None
+
+    def _run(self):
+        started = time.time()
+
+        for session in self._sessions:
+            # wait for the session start, report if we are lagging behind
+            delay = started + (session.start - self._origin) / self._speed - time.time()
+            if delay > 0:
+                gevent.sleep(delay)
+            elif delay < -1:
+                self._late += 1
+                if self._late & (self._late - 1) == 0:
+                    logging.warning(f"Replay is {-delay:.1f}s late, {self._late} late session(s) so far")
+
+            user = self._user_class(self._environment)
+            user.trace = session
+            user.start(self._environment.runner.user_greenlets)
+            self._spawned += 1
+
+        logging.info(f"Replay finished, {self._spawned} session(s) spawned")
+
+    @property
+    def spawned(self) -> int:
+        return self._spawned
@@ -1,5 +1,6 @@
 import logging
-from typing import Union
+import time
+from typing import Optional, Union
 
 import m3u8
 from locust import TaskSet, task
@@ -8,12 +9,16 @@ from m3u8 import M3U8
 from mpegdash.nodes import MPEGDASH
 from locust.contrib.fasthttp import FastHttpSession
 
+from .validation import Validator
+
 
 class Stream(TaskSet):
     def __init__(self, *args, **kwargs):
         super(Stream, self).__init__(*args, **kwargs)
 
         self.throughput = None
+        # last media sequence per playlist, for validation
+        self.media_sequences = {}
 
     def on_start(self):
         # copy initial throughput measurement
@@ -21,6 +26,11 @@ class Stream(TaskSet):
 
     @task
     def stream(self):
+        # end the session gracefully, if its lifetime is over
+        if self.user.deadline is not None and time.time() >= self.user.deadline:
+            self.logger.debug(f"Session ended")
+            raise StopUser()
+
         # check stream type
         if isinstance(self.manifest, M3U8):
             self.hlslive()
@@ -35,16 +45,17 @@ class Stream(TaskSet):
                                lambda pl: pl.stream_info.average_bandwidth,
                                self.throughput,
                                lambda pl: 'avc1' in pl.stream_info.codecs)
-        self.hlslivevariant(playlist, self.user.client_video)
+        self.hlslivevariant(playlist, self.user.client_video, 'video')
 
         # select the audio variant playlist
         playlist = self.select(self.manifest.playlists,
                                lambda pl: pl.stream_info.average_bandwidth,
                                self.throughput,
-                               lambda pl: 'avc1' not in pl.stream_info.codecs)
-        self.hlslivevariant(playlist, self.user.client_audio)
+                               lambda pl: 'avc1' not in pl.stream_info.codecs,
+                               'audio')
+        self.hlslivevariant(playlist, self.user.client_audio, 'audio')
 
-    def hlslivevariant(self, playlist: m3u8.Playlist, client: FastHttpSession):
+    def hlslivevariant(self, playlist: m3u8.Playlist, client: FastHttpSession, track: str):
 
         self.logger.debug(f"Playlist {playlist.uri} selected - "
                           f"BW: {playlist.stream_info.bandwidth / 1000 / 1000:.2f}Mbps, "
@@ -54,6 +65,8 @@ class Stream(TaskSet):
         # download the variant playlist
         with client.get(playlist.base_uri + playlist.uri,
                         headers={'User-Agent': f"Locust/1.0"},
+                        context={'kind': 'playlist', 'track': track,
+                                 'profile': playlist.stream_info.average_bandwidth},
                         catch_response=True) as response_variant:
 
             # in case of error, try next time
@@ -69,18 +82,34 @@ class Stream(TaskSet):
                 response_variant.failure(f"Playlist type {variant.playlist_type}' not supported, stopping user")
                 raise StopUser()
 
+            # validate the playlist (sampled)
+            if self.validator is not None and self.validator.sample():
+                error = self.validator.playlist(variant, self.media_sequences.get(playlist.uri))
+                if error is not None:
+                    response_variant.failure(error)
+            self.media_sequences[playlist.uri] = variant.media_sequence
+
             # get the latest segment
             segment = max(variant.segments, key=lambda s: s.program_date_time.timestamp())
             self.logger.debug(f"Segment {segment.uri} (dur: {segment.duration}) selected.")
 
             with client.get(segment.absolute_uri,
                             headers={'User-Agent': f"Locust/1.0"},
+                            context={'kind': 'segment', 'track': track,
+                                     'profile': playlist.stream_info.average_bandwidth,
+                                     'duration': segment.duration},
                             catch_response=True) as response_segment:
 
                 if response_segment.status_code >= 400:
                     response_segment.failure(f"HTTP error {response_segment.status_code}")
                     self.interrupt(reschedule=False)
 
+                # validate the segment (sampled)
+                if self.validator is not None and self.validator.sample():
+                    error = self.validator.segment(response_segment.headers, response_segment.content)
+                    if error is not None:
+                        response_segment.failure(error)
+
                 # measure throughput with segment
                 self.throughput = response_segment._request_meta['response_length'] * 8 / \
                                   (response_segment._request_meta['response_time'] / 1000)
@@ -125,10 +154,17 @@ class Stream(TaskSet):
     def manifest(self) -> Union[MPEGDASH, Union[MPEGDASH, M3U8]]:
         return self.user.manifest
 
+    @property
+    def validator(self) -> Optional[Validator]:
+        return self.user.environment.validator
+
     @property
     def client_video(self) -> FastHttpSession:
         return self.user.client_video
 
-    def select(self, items, key: callable, throughput: float, condition: callable = lambda x: True):
-        return self.client.environment.profileselector.select(items, key=key, throughput=throughput,
-                                                              condition=condition)
+    def select(self, items, key: callable, throughput: float, condition: callable = lambda x: True,
+               track: str = 'video'):
+        # replayed sessions follow their own profile switches, the traced bandwidths are video bitrates
+        profileselector = self.user.profileselector if track == 'video' and self.user.profileselector else \
+            self.client.environment.profileselector
+        return profileselector.select(items, key=key, throughput=throughput, condition=condition)
@@ -0,0 +1,93 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+import numpy as np
+
+from abrperf.analysis import group_percentiles, stable_order, summary, timeseries, compare, load
+from abrperf.metrics import MetricsAggregator, InfluxDB2Exporter, FileExporter, pyarrow
+
+
+class TestAnalysis(TestCase):
+    def setUp(self):
+        aggregator = MetricsAggregator()
+        for i, (profile, response_time) in enumerate([(1000000, 500), (1000000, 1000), (2000000, 3000),
+                                                      (2000000, 1500)]):
+            aggregator.on_request('GET', f'http://edge{i % 2}/ch1/seg{i}.ts', response_time, 250000,
+                                  SimpleNamespace(status_code=200),
+                                  {'kind': 'segment', 'session': 1, 'profile': profile, 'duration': 2.0}, None)
+        aggregator.on_request('GET', 'http://edge0/ch1/index.m3u8', 100, 0, SimpleNamespace(status_code=404),
+                              {'kind': 'manifest', 'session': 2}, Exception("HTTP error 404"))
+        self.samples = aggregator.drain()
+
+    def test_group_percentiles(self):
+        keys, counts, values = group_percentiles(np.array([1, 0, 1, 1, 0]), np.array([5., 1., 3., 4., 2.]), [0, 0.5, 1])
+        self.assertEqual(keys.tolist(), [0, 1])
+        self.assertEqual(counts.tolist(), [2, 3])
+        self.assertEqual(values.tolist(), [[1., 1., 2.], [3., 4., 5.]])
+
+    def test_stable_order(self):
+        codes = np.array([70000, 1, 70000, 0, 1, 65536])
+        self.assertEqual(stable_order(codes).tolist(), [3, 1, 4, 5, 0, 2])
+
+    def test_summary(self):
+        result = summary(self.samples, [0.5, 1])
+        self.assertEqual(result['requests'], 5)
+        self.assertEqual(result['failures'], 1)
+        self.assertEqual(result['sessions'], 1)
+        self.assertAlmostEqual(result['switch_rate'], 1 / 4)
+        self.assertAlmostEqual(result['total']['total']['stall_ratio'], 1 / 8)
+        self.assertEqual(result['edges']['edge0']['requests'], 3)
+        self.assertEqual(result['profiles']['1000000']['throughput'], [2000000, 4000000])
+
+        # interleaved audio and video segments with constant profiles are no switches
+        aggregator = MetricsAggregator()
+        for i in range(6):
+            track, profile = ('video', 5000000) if i % 2 == 0 else ('audio', 128000)
+            aggregator.on_request('GET', f'http://edge0/ch1/{track}{i}.ts', 100, 100000,
+                                  SimpleNamespace(status_code=200),
+                                  {'kind': 'segment', 'track': track, 'session': 3, 'profile': profile,
+                                   'duration': 2.0}, None)
+        result = summary(aggregator.drain())
+        self.assertEqual(result['sessions'], 1)
+        self.assertEqual(result['switch_rate'], 0)
+
+        # not in recording order, the profiles would alternate
+        samples = self.samples
+        samples.columns = {column: values[[0, 2, 1, 3, 4]] for column, values in samples.columns.items()}
+        self.assertAlmostEqual(summary(samples)['switch_rate'], 1 / 4)
+        self.assertEqual(summary(aggregator.drain())['sessions'], 0)
+
+    def test_timeseries(self):
+        result = timeseries(self.samples, 60)
+        self.assertEqual(result['time'], [0])
+        self.assertAlmostEqual(result['requests'][0], 5 / 60)
+
+    def test_compare(self):
+        change = compare(summary(self.samples), summary(self.samples))
+        self.assertEqual(change['requests'], 0)
+
+    def test_lineprotocol(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'export.lp')
+            with open(filename, 'w') as file:
+                file.write('\n'.join(InfluxDB2Exporter('http://127.0.0.1', 'o', 'b', 't').lines(self.samples)))
+
+            samples = load([filename])
+            self.assertEqual(samples.columns['profile'].tolist(), self.samples.columns['profile'].tolist())
+            self.assertEqual(summary(samples)['failures'], 1)
+
+    def test_load_unreadable(self):
+        if pyarrow is None:
+            self.skipTest("pyarrow is not available")
+        with tempfile.TemporaryDirectory() as directory:
+            exporter = FileExporter(directory, 'parquet')
+            exporter.export(self.samples)
+            exporter.close()
+            # a killed worker's file without footer
+            with open(os.path.join(directory, 'killed.parquet'), 'wb') as file:
+                file.write(b'PAR1' + b'\x00' * 100)
+
+            samples = load(sorted(os.path.join(directory, filename) for filename in os.listdir(directory)))
+            self.assertEqual(len(samples), 5)
@@ -0,0 +1,81 @@
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+
+import gevent
+
+from abrperf.arrival import TimerWheel, RateCurve, SessionLength, Arrivals
+
+
+class TestArrival(TestCase):
+    def test_timerwheel(self):
+        fired = []
+        wheel = TimerWheel(tick=1, slots=8)
+        now = wheel._current
+        wheel.schedule(now + 3.5, fired.append, 'b')
+        wheel.schedule(now + 2.5, fired.append, 'a')
+        wheel.schedule(now + 20.5, fired.append, 'd')
+        wheel.cancel(wheel.schedule(now + 3, fired.append, 'c'))
+        self.assertEqual(len(wheel), 3)
+
+        self.assertEqual(wheel.advance(now + 1), 0)
+        self.assertEqual(wheel.advance(now + 4), 2)
+        self.assertEqual(fired, ['a', 'b'])
+
+        # one round later in the same slot
+        self.assertEqual(wheel.advance(now + 12.5), 0)
+        self.assertEqual(wheel.advance(now + 100), 1)
+        self.assertEqual(fired, ['a', 'b', 'd'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_timerwheel_past(self):
+        fired = []
+        wheel = TimerWheel(tick=1, slots=8)
+        wheel.schedule(0, fired.append, 'x')
+        wheel.advance(wheel._current + 1)
+        self.assertEqual(fired, ['x'])
+
+    def test_timerwheel_stop(self):
+        fired = []
+        wheel = TimerWheel(tick=0.01)
+        wheel.start()
+        wheel.schedule(time.time() + 0.05, fired.append, 'x')
+        wheel.stop()
+        gevent.sleep(0.1)
+        self.assertEqual(fired, [])
+
+    def test_ratecurve(self):
+        curve = RateCurve.parse('0:10,100:20')
+        self.assertEqual(curve(-1), 10)
+        self.assertEqual(curve(50), 15)
+        self.assertEqual(curve(1000), 20)
+        self.assertEqual(RateCurve.parse('5').scaled(0.5)(123), 2.5)
+        with self.assertRaises(ValueError):
+            RateCurve.parse('0:x')
+
+    def test_sessionlength(self):
+        self.assertEqual(SessionLength('constant:60')(), 60)
+        self.assertIsNone(SessionLength('endless')())
+        self.assertGreaterEqual(SessionLength('pareto:1.5,30')(), 30)
+        self.assertGreater(SessionLength('lognormal:6,1')(), 0)
+        with self.assertRaises(ValueError):
+            SessionLength('weibull:1,2')
+
+    def test_arrivals(self):
+        users = []
+
+        class User:
+            def __init__(self, environment):
+                self.deadline = None
+
+            def start(self, group):
+                users.append(self)
+
+        arrivals = Arrivals(SimpleNamespace(runner=SimpleNamespace(user_greenlets=None)), User, RateCurve.parse('100'),
+                            SessionLength('constant:60'))
+        arrivals.start()
+        gevent.sleep(0.5)
+        arrivals.stop()
+        self.assertEqual(arrivals.arrived, len(users))
+        self.assertGreater(len(users), 10)
+        self.assertTrue(all(time.time() + 59 < user.deadline <= time.time() + 60 for user in users))
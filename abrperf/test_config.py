@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from abrperf.config import Config
+from abrperf.profileselector import ABRProfileSelector, MaxProfileSelector
+from abrperf.urllist import URLList
+
+
+class TestConfig(TestCase):
+    def setUp(self):
+        self.config = Config(URLList('urllist.csv', 'http://e/a.m3u8,10\n# comment,1\n"http://e/b,c.m3u8",1\n'),
+                             'abr')
+
+    def test_roundtrip(self):
+        config = Config.loads(self.config.dumps())
+        self.assertEqual(config.version, 0)
+        self.assertEqual(config.urllist.filename, 'urllist.csv')
+        self.assertEqual(config.urllist.dumps(), self.config.urllist.dumps())
+        self.assertEqual(len(config.urllist), 2)
+        self.assertIsInstance(config.profileselector(), ABRProfileSelector)
+
+    def test_update(self):
+        config = self.config.update(profileselection='max')
+        self.assertEqual(config.version, 1)
+        self.assertEqual(config.instance, self.config.instance)
+        self.assertIs(config.urllist, self.config.urllist)
+        self.assertIsInstance(config.profileselector(), MaxProfileSelector)
+        self.assertTrue(config.supersedes(self.config))
+        self.assertFalse(self.config.supersedes(config))
+        self.assertTrue(Config.loads(config.dumps()).supersedes(self.config))
+
+    def test_restarted_master(self):
+        config = self.config.update(profileselection='max')
+        restarted = Config(self.config.urllist, 'min', instance=self.config.instance + 1)
+        self.assertEqual(restarted.version, 0)
+        self.assertTrue(restarted.supersedes(config))
+
+    def test_invalid_profileselection(self):
+        with self.assertRaises(ValueError):
+            self.config.update(profileselection='best')
+        with self.assertRaises(ValueError):
+            Config(None, 'random')
+
+    def test_without_urllist(self):
+        self.assertIsNone(Config.loads(Config(None, 'min').dumps()).urllist)
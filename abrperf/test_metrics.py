@@ -0,0 +1,83 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+from abrperf.metrics import MetricsAggregator, PrometheusExporter, InfluxDB2Exporter, FileExporter, read_samples, \
+    pyarrow, zstandard
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.aggregator = MetricsAggregator()
+        self.aggregator.on_request('GET', 'http://edge1/ch1/seg1.ts', 20, 1000, SimpleNamespace(status_code=200),
+                                   {'kind': 'segment', 'session': 1, 'profile': 3000000, 'duration': 2.0}, None)
+        self.aggregator.on_request('GET', 'http://edge2/ch1/index.m3u8', 700, 0, SimpleNamespace(status_code=404),
+                                   {'kind': 'manifest', 'session': 2}, Exception("HTTP error 404"))
+
+    def test_aggregates(self):
+        self.assertEqual(self.aggregator.counters[(3, 'edge1', 200)], [1, 0, 1000])
+        self.assertEqual(self.aggregator.counters[(1, 'edge2', 404)], [1, 1, 0])
+        self.assertEqual(sum(self.aggregator.histograms[(3, 'edge1')][:-1]), 1)
+
+    def test_drain(self):
+        samples = self.aggregator.drain()
+        self.assertEqual(len(samples), 2)
+        self.assertEqual(samples.columns['profile'].tolist(), [3000000, 0])
+        self.assertEqual(samples.dictionaries['edge'], ['edge1', 'edge2'])
+        self.assertEqual(samples.dictionaries['error'][samples.columns['error'][1]], "HTTP error 404")
+        self.assertEqual(len(self.aggregator.drain()), 0)
+
+    def test_prometheus(self):
+        exporter = PrometheusExporter()
+        exporter._aggregator = self.aggregator
+        text = exporter.render()
+        self.assertIn('kind="segment",edge="edge1",status_code="200"} 1', text)
+        self.assertIn('kind="manifest",edge="edge2",le="500"} 0', text)
+        self.assertIn('kind="manifest",edge="edge2",le="1000"} 1', text)
+
+    def test_influxdb2(self):
+        exporter = InfluxDB2Exporter('http://127.0.0.1:8086', 'org', 'bucket', 'token')
+        lines = exporter.lines(self.aggregator.drain())
+        self.assertEqual(len(lines), 2)
+        self.assertIn('exception=HTTP\\ error\\ 404', lines[1])
+        self.assertIn('response_length=1000i', lines[0])
+
+        self.aggregator.on_request('GET', 'http://edge1/ch1/seg2.ts', 20, 0, SimpleNamespace(status_code=0),
+                                   {'kind': 'segment', 'session': 1}, Exception("connection reset\r\nby peer\n"))
+        lines = exporter.lines(self.aggregator.drain())
+        self.assertEqual(len('\n'.join(lines).splitlines()), 1)
+        self.assertIn('exception=connection\\ reset\\ by\\ peer\\ ', lines[0])
+
+    def test_file(self):
+        for fmt, available in [('parquet', pyarrow), ('npy', zstandard)]:
+            if available is None:
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                directory = os.path.join(directory, 'samples')
+                exporter = FileExporter(directory, fmt)
+                for _ in range(2):
+                    self.setUp()
+                    exporter.export(self.aggregator.drain())
+                exporter.close()
+
+                samples = read_samples(os.path.join(directory, os.listdir(directory)[0]))
+                self.assertEqual(len(samples), 4)
+                self.assertEqual(samples.columns['session'].tolist(), [1, 2, 1, 2])
+                self.assertEqual(samples.dictionaries['edge'], ['edge1', 'edge2'])
+
+    def test_file_rollover(self):
+        for fmt, available in [('parquet', pyarrow), ('npy', zstandard)]:
+            if available is None:
+                continue
+            with tempfile.TemporaryDirectory() as directory:
+                exporter = FileExporter(directory, fmt, rollover=0)
+                for files in [1, 2]:
+                    self.setUp()
+                    exporter.export(self.aggregator.drain())
+                    self.assertEqual(len(os.listdir(directory)), files)
+                    if files > 1:
+                        # the previous file is complete while the exporter is still writing
+                        filename = sorted(os.listdir(directory))[0]
+                        self.assertEqual(len(read_samples(os.path.join(directory, filename))), 2)
+                exporter.close()
@@ -0,0 +1,70 @@
+import gzip
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+
+from abrperf.profileselector import TraceProfileSelector
+from abrperf.replay import Replay, read_trace
+
+TRACE = """# start,url,duration,profiles
+0,http://edge1/ch1/index.m3u8,60,0:1000000;30:3000000
+0.5,http://edge1/ch2/index.m3u8,
+1.5,http://edge1/ch1/index.m3u8,10
+"""
+
+
+class TestReplay(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'trace.csv.gz')
+        with gzip.open(self.filename, 'wt') as file:
+            file.write(TRACE)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read(self):
+        sessions = list(read_trace(self.filename))
+        self.assertEqual([session.start for session in sessions], [0, 0.5, 1.5])
+        self.assertEqual(sessions[0].profiles, [(0, 1000000), (30, 3000000)])
+        self.assertIsNone(sessions[1].duration)
+        self.assertEqual(sessions[2].duration, 10)
+
+    def test_partition(self):
+        self.assertEqual([session.start for session in read_trace(self.filename, 0, 2)], [0, 1.5])
+        self.assertEqual([session.start for session in read_trace(self.filename, 1, 2)], [0.5])
+
+    def test_unordered(self):
+        with gzip.open(self.filename, 'wt') as file:
+            file.write("1,http://edge1/ch1/index.m3u8\n0,http://edge1/ch1/index.m3u8\n")
+        with self.assertRaises(ValueError):
+            list(read_trace(self.filename))
+
+    def test_profileselector(self):
+        items = [SimpleNamespace(bandwidth=bandwidth) for bandwidth in [800000, 2000000, 3500000]]
+        selector = TraceProfileSelector([(0, 1000000), (30, 3000000)])
+        self.assertEqual(selector.select(items, lambda item: item.bandwidth, 0).bandwidth, 800000)
+        selector = TraceProfileSelector([(0, 1000000), (30, 3000000)], started=0)
+        self.assertEqual(selector.select(items, lambda item: item.bandwidth, 0).bandwidth, 3500000)
+
+    def test_origin(self):
+        spawned = []
+
+        class User:
+            def __init__(self, environment):
+                self.trace = None
+
+            def start(self, group):
+                spawned.append((time.time(), self.trace.start))
+
+        # the first session of the second partition starts at 0.5s trace time, not with the replay
+        replay = Replay(SimpleNamespace(runner=SimpleNamespace(user_greenlets=None)), User,
+                        read_trace(self.filename, 1, 2), speed=10)
+        started = time.time()
+        replay.start()
+        replay._greenlet.join()
+        self.assertEqual(replay.spawned, 1)
+        self.assertEqual(spawned[0][1], 0.5)
+        self.assertGreaterEqual(spawned[0][0] - started, 0.04)
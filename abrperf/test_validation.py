@@ -0,0 +1,68 @@
+import datetime
+from types import SimpleNamespace
+from unittest import TestCase
+
+import m3u8
+
+from abrperf.validation import Validator, check_length, check_segment, check_media_sequence, check_pdt_drift
+
+
+def box(kind: bytes, payload: bytes = b'') -> bytes:
+    return (len(payload) + 8).to_bytes(4, 'big') + kind + payload
+
+
+class TestValidation(TestCase):
+    def test_length(self):
+        self.assertIsNone(check_length('3', b'abc'))
+        self.assertIsNone(check_length(None, b'abc'))
+        self.assertEqual(check_length('4', b'abc'), "validation: content-length mismatch")
+
+    def test_ts(self):
+        packet = b'\x47' + b'\x00' * 187
+        self.assertIsNone(check_segment(packet * 3))
+        self.assertEqual(check_segment(packet * 3 + b'\x47'), "validation: ts truncated")
+        self.assertEqual(check_segment(packet + b'\x00' * 188), "validation: ts sync byte")
+
+    def test_mp4(self):
+        segment = box(b'styp', b'msdh') + box(b'moof', b'\x00' * 16) + box(b'mdat', b'\x01' * 100)
+        self.assertIsNone(check_segment(segment))
+        self.assertEqual(check_segment(segment[:-10]), "validation: fmp4 truncated")
+        # subsegment index, random access and metadata boxes, unknown types are legal
+        self.assertIsNone(check_segment(box(b'sidx', b'\x00' * 24) + box(b'ssix', b'\x00' * 8) + segment +
+                                        box(b'udta') + box(b'meta', b'\x00' * 4) + box(b'xxxx') + box(b'mfra')))
+        self.assertEqual(check_segment(b'\x00\x00\x00\x04moof' + segment), "validation: fmp4 box size")
+        self.assertEqual(check_segment(b'\x00\x00\x00\x01mdat' + (8).to_bytes(8, 'big') + segment),
+                         "validation: fmp4 box size")
+        self.assertEqual(check_segment(box(b'moof') + b'\x00\x00\x10\x00mdat'), "validation: fmp4 truncated")
+        self.assertIsNone(check_segment(b'ID3\x04'))
+        self.assertEqual(check_segment(b''), "validation: empty segment")
+
+    def test_playlist(self):
+        self.assertIsNone(check_media_sequence(None, 10))
+        self.assertIsNone(check_media_sequence(10, 10))
+        self.assertEqual(check_media_sequence(11, 10), "validation: media sequence decreased")
+        self.assertEqual(check_pdt_drift(100, 200, 30), "validation: pdt drift")
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        variant = SimpleNamespace(media_sequence=5,
+                                  segments=[SimpleNamespace(current_program_date_time=now, duration=2.0)])
+        self.assertIsNone(Validator(1).playlist(variant, 4))
+        self.assertEqual(Validator(1).playlist(variant, 6), "validation: media sequence decreased")
+        variant.segments[0].current_program_date_time = now - datetime.timedelta(minutes=5)
+        self.assertEqual(Validator(1).playlist(variant, 4), "validation: pdt drift")
+
+    def test_playlist_first_pdt(self):
+        # only the first segment carries the program date time
+        def playlist(start: datetime.datetime):
+            return m3u8.loads("#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:5\n"
+                              f"#EXT-X-PROGRAM-DATE-TIME:{start.isoformat()}\n"
+                              "#EXTINF:2.0,\nseg5.ts\n#EXTINF:2.0,\nseg6.ts\n#EXTINF:2.0,\nseg7.ts\n")
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.assertIsNone(Validator(1).playlist(playlist(now - datetime.timedelta(seconds=6)), 5))
+        self.assertEqual(Validator(1).playlist(playlist(now - datetime.timedelta(minutes=5)), 5),
+                         "validation: pdt drift")
+
+    def test_sample(self):
+        self.assertFalse(Validator(0).sample())
+        self.assertTrue(Validator(1).sample())
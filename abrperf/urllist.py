@@ -1,34 +1,55 @@
 import csv
+import io
 import random
 
 
 class URLList:
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, content: str = None):
+        """
+        :param filename: urllist file, read if no content is given
+        :param content: the urllist in csv format (e.g. received from the master)
+        """
         self._filename = filename
         self._urls = []
         self._weights = []
 
-        with open(self._filename, newline='') as csvfile:
-            lines = csv.reader(csvfile, delimiter=',', quotechar='"', skipinitialspace=True)
+        if content is None:
+            with open(self._filename, newline='') as csvfile:
+                self._parse(csvfile)
+        else:
+            self._parse(io.StringIO(content, newline=''))
 
-            for row in lines:
-                if len(row) < 2:
-                    raise SyntaxError(f"urllist file '{self._filename}' must have two columns: '{', '.join(row)}'!")
+        if len(self._urls) == 0:
+            raise SyntaxError(f"Empty urllist file '{self._filename}'!")
 
-                # skip comment lines
-                if row[0].startswith('#'):
-                    continue
+    def _parse(self, csvfile):
+        lines = csv.reader(csvfile, delimiter=',', quotechar='"', skipinitialspace=True)
 
-                if not row[1].strip().isdigit() or int(row[1]) <= 0:
-                    raise ValueError(
-                        f"Positive integers expected in urllist file '{self._filename}', but got '{row[1]}'!")
+        for row in lines:
+            if len(row) < 2:
+                raise SyntaxError(f"urllist file '{self._filename}' must have two columns: '{', '.join(row)}'!")
 
-                self._urls.append(str(row[0]))
-                self._weights.append(int(row[1]))
+            # skip comment lines
+            if row[0].startswith('#'):
+                continue
 
-        if len(self._urls) == 0:
-            raise SyntaxError(f"Empty urllist file '{self._filename}'!")
+            if not row[1].strip().isdigit() or int(row[1]) <= 0:
+                raise ValueError(
+                    f"Positive integers expected in urllist file '{self._filename}', but got '{row[1]}'!")
+
+            self._urls.append(str(row[0]))
+            self._weights.append(int(row[1]))
+
+    def dumps(self) -> str:
+        """
+        Returns the urllist in csv format, it can be parsed back with the content parameter.
+        :return: urllist csv
+        :rtype: str
+        """
+        output = io.StringIO(newline='')
+        csv.writer(output, delimiter=',', quotechar='"').writerows(zip(self._urls, self._weights))
+        return output.getvalue()
 
     def geturl(self) -> str:
         """
@@ -0,0 +1,123 @@
+import random
+import time
+from typing import Optional
+
+TS_PACKET = 188
+TS_SYNC = 0x47
+
+
+def check_length(content_length: Optional[str], body: bytes) -> Optional[str]:
+    """
+    Compares the Content-Length header with the received bytes.
+    :return: failure category or None
+    """
+    if content_length is not None and content_length.isdigit() and int(content_length) != len(body):
+        return "validation: content-length mismatch"
+    return None
+
+
+def check_ts(body: bytes) -> Optional[str]:
+    """
+    Checks the MPEG-TS packet structure: whole packets, each starting with the sync byte.
+    """
+    if len(body) % TS_PACKET:
+        return "validation: ts truncated"
+    if body[::TS_PACKET].count(TS_SYNC) != len(body) // TS_PACKET:
+        return "validation: ts sync byte"
+    return None
+
+
+def check_mp4(body: bytes) -> Optional[str]:
+    """
+    Walks the top level fMP4 boxes: valid sizes adding up to the segment size. The box types are not checked, unknown
+    types are legal.
+    """
+    position = 0
+    while position < len(body):
+        if position + 8 > len(body):
+            return "validation: fmp4 truncated"
+
+        size = int.from_bytes(body[position:position + 4], 'big')
+        header = 8
+        if size == 1:
+            if position + 16 > len(body):
+                return "validation: fmp4 truncated"
+            size = int.from_bytes(body[position + 8:position + 16], 'big')
+            header = 16
+        elif size == 0:
+            # box extends to the end of the segment
+            size = len(body) - position
+
+        if size < header:
+            return "validation: fmp4 box size"
+        position += size
+
+    if position != len(body):
+        return "validation: fmp4 truncated"
+    return None
+
+
+def check_segment(body: bytes) -> Optional[str]:
+    """
+    Checks the container of a media segment, MPEG-TS or fMP4. Packed audio (ID3 or ADTS) is not checked.
+    """
+    if not body:
+        return "validation: empty segment"
+    if body[0] == TS_SYNC:
+        return check_ts(body)
+    if body[:3] == b'ID3' or (body[0] == 0xff and len(body) > 1 and body[1] & 0xf0 == 0xf0):
+        return None
+    return check_mp4(body)
+
+
+def check_media_sequence(previous: Optional[int], current: Optional[int]) -> Optional[str]:
+    """
+    The media sequence of a live playlist must not decrease between reloads.
+    """
+    if previous is not None and current is not None and current < previous:
+        return "validation: media sequence decreased"
+    return None
+
+
+def check_pdt_drift(segment_end: float, now: float, max_drift: float) -> Optional[str]:
+    """
+    The end of the latest segment (program date time + duration) must be close to the wall clock.
+    """
+    if abs(now - segment_end) > max_drift:
+        return "validation: pdt drift"
+    return None
+
+
+class Validator:
+    """
+    Sampled validation of playlists and segments, the per request cost is a random number unless sampled. The checks
+    return the failure category (a constant message, so the failures are grouped by check) or None.
+    """
+
+    def __init__(self, sample: float, max_drift: float = 30):
+        self._sample = sample
+        self._max_drift = max_drift
+
+    def sample(self) -> bool:
+        return self._sample > 0 and random.random() < self._sample
+
+    def playlist(self, variant, previous: Optional[int]) -> Optional[str]:
+        """
+        :param variant: parsed media playlist
+        :param previous: media sequence of the previous reload of the same playlist
+        """
+        error = check_media_sequence(previous, variant.media_sequence)
+        # the program date time is often only tagged on the first segment, the parser carries it forward
+        if error is None and variant.segments and variant.segments[-1].current_program_date_time is not None:
+            segment = variant.segments[-1]
+            error = check_pdt_drift(segment.current_program_date_time.timestamp() + segment.duration, time.time(),
+                                    self._max_drift)
+        return error
+
+    def segment(self, headers, body: bytes) -> Optional[str]:
+        # the length of encoded responses differs from the decoded body
+        content_length = None if headers.get('Content-Encoding') else headers.get('Content-Length')
+        return check_length(content_length, body) or check_segment(body)
+
+    def __str__(self):
+        return f"{self.__class__.__name__} (sample: {self._sample}, max pdt drift: {self._max_drift}s)"
@@ -1,29 +1,29 @@
 import os
 import logging
-import queue
+import random
 import resource
 import time
 
 import locust.stats
 import names
 import platform
-from common import Stream, ProfileSelector, ABRProfileSelector, MaxProfileSelector, MinProfileSelector, URLList
+from common import Stream, URLList, Config, \
+    MetricsAggregator, PrometheusExporter, InfluxDBExporter, InfluxDB2Exporter, FileExporter, TraceProfileSelector, \
+    Replay, read_trace, Arrivals, RateCurve, SessionLength, Validator
 import m3u8
 from mpegdash.parser import MPEGDASHParser
 
 from locust import constant, events, stats
 from locust.exception import StopUser
 from locust.contrib.fasthttp import FastHttpUser, FastHttpSession, FastResponse
-from locust.runners import STATE_STOPPING, STATE_STOPPED, STATE_CLEANUP, WorkerRunner, MasterRunner
+from locust.runners import WorkerRunner, MasterRunner
 import gevent
+import gevent.event
 from locust.env import Environment
 from locust.stats import stats_printer, stats_history
 from locust.log import setup_logging
 
-from queue import SimpleQueue
 from typing import Dict
-from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBServerError
 
 # silent urllib logging
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -44,12 +44,37 @@ def on_locust_init(environment, **kwargs):
     :param environment: Environment instance
     """
     environment.reportergreenlet = None
+    environment.quitting = gevent.event.Event()
 
     try:
         # setup logging
         setup_logging(os.getenv('LOGLEVEL', 'INFO'))  # TODO: use locust's loglevel (args?)
         logging.debug(f"Using percentiles {locust.stats.PERCENTILES_TO_REPORT}")
 
+        # the config is loaded by the master (or standalone) once, workers receive it
+        environment.configured = gevent.event.Event()
+        environment.configwatcher = None
+        environment.partition = None
+        if isinstance(environment.runner, WorkerRunner):
+            environment.runner.register_message('abrperf_config', on_config)
+            environment.runner.register_message('abrperf_partition', on_partition)
+            environment.runner.send_message('abrperf_config_request')
+        else:
+            environment.config = load_config()
+            logging.info(f"Using {environment.config}")
+            environment.configwatcher = gevent.spawn(config_watcher, environment)
+
+            if isinstance(environment.runner, MasterRunner):
+                environment.runner.register_message('abrperf_config_request', on_config_request)
+            else:
+                apply_config(environment, environment.config)
+
+            web_ui = kwargs.get('web_ui')
+            if web_ui is not None:
+                web_ui.app.add_url_rule('/abrperf/config', 'abrperf_config',
+                                        web_ui.auth_required_if_enabled(lambda: config_view(environment)),
+                                        methods=['GET', 'POST'])
+
         # init workers
         if isinstance(environment.runner, MasterRunner):
             logging.debug(f"I'm the master on {platform.node()} node")
@@ -60,50 +85,215 @@ def on_locust_init(environment, **kwargs):
             resource.setrlimit(resource.RLIMIT_NOFILE, resource.getrlimit(resource.RLIMIT_NOFILE))
             logging.info(f"rlimit_nofile is {resource.getrlimit(resource.RLIMIT_NOFILE)}")
 
-            # profile selector
-            method = os.getenv('PROFILESELECTION', 'rnd')
-            if method == 'min':
-                environment.profileselector = MinProfileSelector()
-            elif method == 'max':
-                environment.profileselector = MaxProfileSelector()
-            elif method == 'abr':
-                environment.profileselector = ABRProfileSelector()
-            else:
-                environment.profileselector = ProfileSelector()
-
-            logging.info(f"Using {environment.profileselector}")
-
-            # url reader
-            environment.urllist = URLList(os.getenv('URLLIST', default='urllist.csv'))
-            logging.info(f"Using {environment.urllist.filename} with {len(environment.urllist)} url(s)")
-
-            # influx connection for reporting
-            environment.influxdbclient = InfluxDBClient(os.getenv('INFLUXHOST', '127.0.0.1'),
-                                                        int(os.getenv('INFLUXPORT', '8086')),
-                                                        os.getenv('INFLUXUSERNAME', 'locust'),
-                                                        os.getenv('INFLUXPASSWORD', 'locust12'),
-                                                        os.getenv('INFLUXDATABASE', 'locust'),
-                                                        proxies={})
-            environment.influxdbclient.ping()
+            environment.driver = None
+
+            # sampled segment and playlist validation
+            environment.validator = None
+            if float(os.getenv('VALIDATESAMPLE', '0')) > 0:
+                environment.validator = Validator(float(os.getenv('VALIDATESAMPLE')),
+                                                  float(os.getenv('VALIDATEPDTDRIFT', '30')))
+                logging.info(f"Using {environment.validator}")
+
+            # metrics aggregator and exporters for reporting
+            environment.metrics = MetricsAggregator()
+            environment.exporters = []
+            for exporter in os.getenv('EXPORTERS', 'influxdb').split(sep=','):
+                exporter = exporter.strip()
+                if exporter == 'influxdb':
+                    environment.exporters.append(InfluxDBExporter(os.getenv('INFLUXHOST', '127.0.0.1'),
+                                                                  int(os.getenv('INFLUXPORT', '8086')),
+                                                                  os.getenv('INFLUXUSERNAME', 'locust'),
+                                                                  os.getenv('INFLUXPASSWORD', 'locust12'),
+                                                                  os.getenv('INFLUXDATABASE', 'locust')))
+                elif exporter == 'influxdb2':
+                    environment.exporters.append(InfluxDB2Exporter(os.getenv('INFLUXURL', 'http://127.0.0.1:8086'),
+                                                                   os.getenv('INFLUXORG', 'DT'),
+                                                                   os.getenv('INFLUXBUCKET', 'locust'),
+                                                                   os.getenv('INFLUXTOKEN', '')))
+                elif exporter == 'prometheus':
+                    environment.exporters.append(PrometheusExporter(int(os.getenv('PROMETHEUSPORT', '9646'))))
+                elif exporter == 'file':
+                    environment.exporters.append(FileExporter(os.getenv('FILESINKDIR', '.'),
+                                                              os.getenv('FILESINKFORMAT'),
+                                                              float(os.getenv('FILESINKROLLOVER', '300'))))
+                elif exporter:
+                    raise ValueError(f"Unknown exporter '{exporter}'!")
+
+            for exporter in environment.exporters:
+                exporter.start(environment.metrics)
+            logging.info(f"Using exporters {', '.join(map(str, environment.exporters))}")
 
             # event handler for reporting
-            environment.queue = SimpleQueue()
             environment.events.request.add_listener(on_request)
             environment.reportergreenlet = gevent.spawn(reporter, environment)
 
             # silence stats logger
             # logging.getLogger('locust.stats_logger').setLevel(logging.ERROR)
 
-    except InfluxDBServerError as e:
-        logging.error(f"Cannot connect to influxdb: {e}")
-        exit(-1)
     except Exception:
         logging.exception("Exception in init")
         if environment.reportergreenlet:
             gevent.kill(environment.reportergreenlet)
+        if environment.configwatcher:
+            gevent.kill(environment.configwatcher)
         exit(-1)
 
 
+def load_config() -> Config:
+    # no urllist is needed for trace replay
+    urllist = None if os.getenv('REPLAY') else URLList(os.getenv('URLLIST', default='urllist.csv'))
+    return Config(urllist, os.getenv('PROFILESELECTION', 'rnd'))
+
+
+def apply_config(environment, config: Config):
+    """
+    Replaces the urllist and the profile selector, running users pick them up with their next session and profile
+    selection.
+    """
+    environment.config = config
+    environment.urllist = config.urllist
+    environment.profileselector = config.profileselector()
+    environment.configured.set()
+
+
+def publish_config(environment, config: Config):
+    environment.config = config
+    logging.info(f"Publishing {config}")
+    if isinstance(environment.runner, MasterRunner):
+        environment.runner.send_message('abrperf_config', config.dumps())
+    else:
+        apply_config(environment, config)
+
+
+def on_config_request(environment, msg, **kwargs):
+    """
+    Master: a worker connected, send the current config.
+    """
+    environment.runner.send_message('abrperf_config', environment.config.dumps(), client_id=msg.node_id)
+
+
+def on_config(environment, msg, **kwargs):
+    """
+    Worker: new config received from the master.
+    """
+    config = Config.loads(msg.data)
+    if environment.configured.is_set() and not config.supersedes(environment.config):
+        return
+    apply_config(environment, config)
+    logging.info(f"Using {config}")
+
+
+def on_partition(environment, msg, **kwargs):
+    """
+    Worker: share of the trace or the arrival rate for the next test, sent by the master at test start.
+    """
+    environment.partition = (msg.data['index'], msg.data['count'])
+
+
+def config_watcher(environment):
+    """
+    Reloads and publishes the urllist, if the file changes.
+    """
+    interval = float(os.getenv('CONFIGPOLL', '5'))
+    filename = os.getenv('URLLIST', default='urllist.csv')
+    mtime = os.path.getmtime(filename) if os.path.exists(filename) else None
+
+    while True:
+        gevent.sleep(interval)
+        if environment.config.urllist is None or not os.path.exists(filename) or os.path.getmtime(filename) == mtime:
+            continue
+        mtime = os.path.getmtime(filename)
+
+        try:
+            publish_config(environment, environment.config.update(urllist=URLList(filename)))
+        except Exception:
+            logging.exception(f"Cannot reload {filename}, keeping the current urllist")
+
+
+def config_view(environment):
+    """
+    Web UI: GET returns the current config, POST updates it (form or json fields 'profileselection' and 'urllist' in
+    csv format).
+    """
+    from flask import request, jsonify
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        try:
+            urllist = URLList('web', data['urllist']) if data.get('urllist') else None
+            config = environment.config.update(urllist, data.get('profileselection'))
+        except (SyntaxError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        publish_config(environment, config)
+
+    return jsonify({'version': environment.config.version,
+                    'profileselection': environment.config.profileselection,
+                    'urls': len(environment.config.urllist) if environment.config.urllist else 0})
+
+
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    """
+    Fired when a new load test is started, on the master and on the workers.
+    Event arguments:
+    :param environment: Environment instance
+    """
+    if not (os.getenv('REPLAY') or os.getenv('ARRIVALRATE')):
+        return
+
+    # the trace and the arrival rate are shared among the workers connected at test start, the master sends every
+    # worker its share before the spawn messages
+    if isinstance(environment.runner, MasterRunner):
+        workers = environment.runner.clients.ready + environment.runner.clients.spawning + \
+            environment.runner.clients.running
+        for index, worker in enumerate(workers):
+            environment.runner.send_message('abrperf_partition', {'index': index, 'count': len(workers)},
+                                            client_id=worker.id)
+        return
+
+    index, count = 0, 1
+    if isinstance(environment.runner, WorkerRunner):
+        if environment.partition is None:
+            raise RuntimeError("No share of the load received from the master (worker joined a running test?)")
+        index, count = environment.partition
+
+    if os.getenv('REPLAY'):
+        logging.info(f"Replaying partition {index}/{count} of {os.getenv('REPLAY')}")
+        environment.driver = Replay(environment, ABRUser, read_trace(os.getenv('REPLAY'), index, count),
+                                    float(os.getenv('REPLAYSPEED', '1.0')))
+    else:
+        rate = RateCurve.parse(os.getenv('ARRIVALRATE')).scaled(1 / count)
+        length = SessionLength(os.getenv('SESSIONLENGTH', 'endless'))
+        logging.info(f"Open-loop arrivals, {1 / count:.4f} share of rate {os.getenv('ARRIVALRATE')}/s, "
+                     f"session length {length}")
+        environment.driver = Arrivals(environment, ABRUser, rate, length)
+    environment.driver.start()
+
+
+@events.test_stopping.add_listener
+def on_test_stopping(environment, **kwargs):
+    """
+    Fired when a load test is about to stop, before the users are stopped.
+    Event arguments:
+    :param environment: Environment instance
+    """
+    # no new users while the runner stops the running ones
+    if getattr(environment, 'driver', None):
+        environment.driver.stop()
+        environment.driver = None
+
+
+@events.test_stop.add_listener
+def on_test_stop(environment, **kwargs):
+    """
+    Fired when a load test is stopped.
+    Event arguments:
+    :param environment: Environment instance
+    """
+    # the next test gets a new share
+    environment.partition = None
+
+
 @events.quitting.add_listener
 def on_locust_quitting(environment, **kwargs):
     """
@@ -112,12 +302,17 @@ def on_locust_quitting(environment, **kwargs):
     :param environment: Environment instance
     """
     if environment.reportergreenlet:
-        gevent.wait(environment.reportergreenlet)
-    environment.influxdbclient.close()
-    pass
+        # let the reporter finish its current export, then export the rest
+        environment.quitting.set()
+        gevent.wait([environment.reportergreenlet])
+        export(environment)
+    for exporter in getattr(environment, 'exporters', []):
+        try:
+            exporter.close()
+        except Exception:
+            logging.exception(f"Exception while closing {exporter}")
 
 
-@events.request.add_listener
 def on_request(request_type: str, name: str, response_time: int, response_length: int, response: FastResponse,
                context: Dict, exception: Exception, **kwargs):
     """
@@ -126,58 +321,31 @@ def on_request(request_type: str, name: str, response_time: int, response_length
     :param response_time: Time in milliseconds until exception was thrown
     :param response_length: Content-length of the response
     :param response: Response object (e.g. a :py:class:`requests.Response`)
-    :param context: :ref:`User/request context <request_context>`
+    :param context: :ref:`User/request context <request_context>`, the 'kind', 'profile' and 'duration' keys are
+    set by the Stream for the analysis
     :param exception: Exception instance that was thrown. None if request was successful.
-    {
-        "measurement": "cpu_load_short",
-        "tags": {
-            "host": "server01",
-            "region": "us-west"
-        },
-        "time": "2009-11-10T23:00:00Z",
-        "fields": {
-            "value": 0.64
-        }
-    }
     """
 
-    if 'queue' in context:
-        context['queue'].put_nowait({'measurement': 'request',
-                                     'tags': {
-                                         'name': name,
-                                         'server': platform.node(),
-                                         'request_type': request_type,
-                                         'status_code': response.status_code,
-                                         'exception': str(exception)
-                                     },
-                                     'time': time.time_ns(),
-                                     'fields': {
-                                         'response_time': response_time,
-                                         'response_length': response_length
-                                     }
-                                     })
+    if 'metrics' in context:
+        context['metrics'].on_request(request_type, name, response_time, response_length, response, context,
+                                      exception)
 
 
-def reporter(environment):
-    # build chunk while running
-    while environment.runner.state not in [STATE_STOPPING, STATE_STOPPED, STATE_CLEANUP]:
-
-        json_body = []
-        # get reports, limit chunk size to 100 while running
-        while environment.runner.state not in [STATE_STOPPING, STATE_STOPPED, STATE_CLEANUP] and len(json_body) < 100:
-            try:
-                json_body.append(environment.queue.get(block=True, timeout=0.2))
-            except queue.Empty:
-                # if there is no more report within 0.2s, write it
-                break
-            except Exception:
-                logging.exception(f"Exception during writing logs ")
-
-        # send reports
+def export(environment):
+    # every exporter gets the same batch
+    samples = environment.metrics.drain()
+    for exporter in environment.exporters:
         try:
-            environment.influxdbclient.write_points(json_body)
+            exporter.export(samples)
         except Exception:
-            logging.exception(f"Exception during writing logs ")
+            logging.exception(f"Exception during exporting to {exporter}")
+
+
+def reporter(environment):
+    # drain the aggregator periodically until quitting, across test runs and the graceful stop of the users
+    interval = float(os.getenv('FLUSHINTERVAL', '1.0'))
+    while not environment.quitting.wait(interval):
+        export(environment)
 
 
 class ABRUser(FastHttpUser):
@@ -186,6 +354,14 @@ class ABRUser(FastHttpUser):
 
         self.name = names.get_full_name()
         self.logger = logging.getLogger(self.name)
+        self.session = random.getrandbits(63)
+
+        # session of the trace to replay, set by the Replay before start
+        self.trace = None
+        # session end (epoch), None for endless sessions: set by the Arrivals or from the replayed session duration
+        self.deadline = None
+        # per user profile selector, overrides the environment's one (e.g. for trace replay)
+        self.profileselector = None
 
         self.manifest = None
         # self.base_url = None
@@ -202,8 +378,8 @@ class ABRUser(FastHttpUser):
         """
         Adds the returned value (a dict) to the context for request event
         """
-        # pass the queue object to the request event
-        return {"queue": self.environment.queue}
+        # pass the metrics aggregator and the session id to the request event
+        return {"metrics": self.environment.metrics, "session": self.session}
 
     def on_start(self):
         """
@@ -219,8 +395,23 @@ class ABRUser(FastHttpUser):
         # self.variant = None
         # self.variant_pls = None
 
-        # get a manifest url
-        manifest_url = self.environment.urllist.geturl()
+        # wait for the config from the master
+        if not self.environment.configured.wait(timeout=60):
+            self.logger.error("No config received from the master, stopping user")
+            raise StopUser()
+
+        # get a manifest url, replayed sessions bring their own
+        if self.trace is not None:
+            manifest_url = self.trace.url
+            if self.trace.duration is not None:
+                self.deadline = time.time() + self.trace.duration
+            if self.trace.profiles:
+                self.profileselector = TraceProfileSelector(self.trace.profiles)
+        elif os.getenv('REPLAY'):
+            # in replay mode, the users are spawned by the trace
+            raise StopUser()
+        else:
+            manifest_url = self.environment.urllist.geturl()
         base_url = os.path.dirname(manifest_url)
         self.logger.debug(f"URL to open: {manifest_url}")
 
@@ -229,6 +420,7 @@ class ABRUser(FastHttpUser):
                 f"{manifest_url}{'&' if '?' in manifest_url else '?'}uid={self.name.replace(' ', '_')}",
                 name=manifest_url,
                 headers={'User-Agent': f"Locust/1.0"},
+                context={'kind': 'manifest'},
                 catch_response=True) as response:
 
             if response.status_code >= 400:
@@ -331,6 +523,11 @@ class ABRUser(FastHttpUser):
             # self.logger.debug(f"running {self.__class__.__name__}")
 
     def on_stop(self):
+        # end the session like a player: close the connections, the next session opens new ones
+        for client in [self.client, self.client_video, self.client_audio]:
+            if client is not None:
+                client.client.close()
+
         self.logger.debug(f"user terminated")
 
     # how long to wait between rescheduling Streaming
@@ -8,10 +8,9 @@ masterhost=127.0.0.1
 numslaves=2
 
 for host in ${slavehosts[*]}; do
-  # sync config
+  # sync config (the urllist is distributed by the master)
   echo "syncing config with slave $host..."
   scp -q ./abrperf.ini $host:abrperf/
-  scp -q ./urllist.csv $host:abrperf/
 
   # start slaves
   ssh $host "rm -f ~/abrperf/slaves.pid"